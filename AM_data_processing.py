@@ -4,21 +4,22 @@ import numpy as np
 import requests
 import os
 import logging
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
-import seaborn as sns
-from alphafold_api_downloader import fetch_AFDB_data
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from alphafold_api_downloader import fetch_AFDB_data, read_uniprot_ids, SESSION, REQUEST_TIMEOUT
 import plots
+from plots import ensure_directory_exists
 import argparse
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 ### Change the logging to DEBUG when needed to turn the logs back on
 
-def ensure_directory_exists(directory):
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-        logging.info(f"Created directory: {directory}")
+# The 20 standard amino acids, used as categories for the reference and alternative residues
+AMINO_ACIDS = list("ACDEFGHIKLMNPQRSTVWY")
 
+# The plots reuse one Figure per plot type, so they are drawn one at a time
+PLOT_LOCK = threading.Lock()
 
 def extract_alpha_missense_url(data):
     """Extracts the AlphaMissense URL from the API data.
@@ -27,13 +28,12 @@ def extract_alpha_missense_url(data):
         data (dict): The JSON data from the API.
 
     Returns:
-        str: The AlphaMissense URL, or an error message.
+        str or None: The AlphaMissense URL, or None if the entry has no AlphaMissense data.
     """
-    if data:
-        logging.info(f"Retrieving AM data")
-        return data[0].get('amAnnotationsUrl', f"No AlphaMissense data for this protein.")
-    else:
-        return "Error: No data provided."
+    if not data:
+        return None
+    logger.info("Retrieving AM data")
+    return data[0].get('amAnnotationsUrl')
 
 
 def extract_pdb_url(data):
@@ -43,48 +43,69 @@ def extract_pdb_url(data):
         data (dict): The JSON data from the API.
 
     Returns:
-        str: The PDB url, or an error message.
+        str or None: The PDB url, or None if the entry has no PDB file.
     """
-    if data:
-        logging.info(f"Retrieving url for PDB file")
-        return data[0].get('pdbUrl', "Failed to retrieve PDB URL.")
-    else:
-        return "Error: No data provided."
+    if not data:
+        return None
+    logger.info("Retrieving url for PDB file")
+    return data[0].get('pdbUrl')
     
 
 
-def extract_am_data(am_url):
+def extract_am_data(am_url, cache_dir="downloaded_files"):
     """
-    Extract AlphaMissense data from the url and saves it as a CSV file
+    Extract AlphaMissense data from the url and saves it as a Parquet file
+
+    The raw AM CSV is kept in cache_dir (the same place alphafold_api_downloader.py
+    saves it) and is only downloaded when it is not already there.
     """
+    cache_file = os.path.join(cache_dir, os.path.basename(am_url))
     try:
-        am_file = pd.read_csv(am_url)
+        if not os.path.exists(cache_file):
+            response = SESSION.get(am_url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            ensure_directory_exists(cache_dir)
+            # Write to a temporary name first so an interrupted run never leaves a truncated cache
+            with open(cache_file + ".part", "wb") as f:
+                f.write(response.content)
+            os.replace(cache_file + ".part", cache_file)
+        else:
+            logger.info("Using cached AM file: %s", cache_file)
+
+        # Only the variant and score columns are used, so skip parsing am_class
+        am_file = pd.read_csv(cache_file,
+                              usecols=["protein_variant", "am_pathogenicity"],
+                              dtype={"am_pathogenicity": np.float32})
     except Exception as e:
-        logging.error(f"Error reading AM file: {e}")
+        logger.error("Error reading AM file: %s", e)
         return None
         
-    reference_aa = am_file["protein_variant"].str.extract(r'^([A-Z])')[0]
-    alternative_aa = am_file["protein_variant"].str.extract('([A-Z])$')[0]
-    residue_number = pd.to_numeric(am_file["protein_variant"].str.extract(r'([0-9]+)')[0])
-    pathogenicity_score = pd.to_numeric(am_file['am_pathogenicity'])
+    # Variants are always <reference AA><residue number><alternative AA>, e.g. "A123V"
+    protein_variant = am_file["protein_variant"].to_numpy()
+    reference_aa = np.array([variant[0] for variant in protein_variant])
+    alternative_aa = np.array([variant[-1] for variant in protein_variant])
+    residue_number = np.fromiter((int(variant[1:-1]) for variant in protein_variant),
+                                 dtype=np.int32, count=len(protein_variant))
+    pathogenicity_score = am_file['am_pathogenicity'].to_numpy(dtype=np.float32, copy=False)
         
     am_data = pd.DataFrame({
-        'reference_aa': reference_aa,
+        'reference_aa': pd.Categorical(reference_aa, categories=AMINO_ACIDS),
         'residue_number': residue_number,
-        "alternative_aa":alternative_aa,
+        "alternative_aa": pd.Categorical(alternative_aa, categories=AMINO_ACIDS),
         "pathogenicity_score": pathogenicity_score})
         
     output_directory = "data_output"
     ensure_directory_exists(output_directory)
-    output_filename = os.path.basename(am_url)
+    # Parquet keeps the narrow/categorical dtypes and is much smaller and faster to reload than CSV
+    output_filename = os.path.splitext(os.path.basename(am_url))[0] + ".parquet"
     output_file = os.path.join(output_directory, output_filename)
 
     
     try:
-        am_data.to_csv(output_file, index=False)
-        logging.info(f"AM data saved to: {output_filename}")
+        am_data.to_parquet(output_file, engine="pyarrow", compression="zstd", index=False)
+        logger.info("AM data saved to: %s", output_filename)
     except Exception as e:
-        logging.error(f"Error saving AM data: {e}")
+        logger.error("Error saving AM data: %s", e)
         
     return am_data
         
@@ -92,150 +113,172 @@ def calculate_average_pathogenicity(am_data):
     """Calculates average pathogenicity scores per residue from AM data
     """
     if am_data is None:
-        logging.error("No AlphaMissense data available")
+        logger.error("No AlphaMissense data available")
         return None
     
-    grouped = am_data.groupby(['residue_number'])['pathogenicity_score'].mean().reset_index()
-    max_residue_number = grouped['residue_number'].max()
-    average_scores = np.full(max_residue_number + 1, np.nan)
-    
-    for _, row in grouped.iterrows():
-        residue_number = int(row['residue_number'])
-        average_scores[residue_number] = round(row['pathogenicity_score'], 4)
+    # Residue numbers are small dense integers, so sum and count them per position directly
+    residue_numbers = am_data['residue_number'].to_numpy(dtype=np.intp)
+    scores = am_data['pathogenicity_score'].to_numpy(dtype=np.float64)
+    sums = np.bincount(residue_numbers, weights=scores)
+    counts = np.bincount(residue_numbers)
+
+    average_scores = np.full(len(counts), np.nan)
+    observed = counts > 0
+    average_scores[observed] = np.round(sums[observed] / counts[observed], 4)
     return average_scores
 
 
-def modify_pdb_with_am_data(pdb_url, average_scores_file):
-    
-    if pdb_url:
-        try:
-            logging.info("Retrieving PDB file")
-            pdb_content = requests.get(pdb_url).text.splitlines()
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Failed to retrieve the PDB file: {e}")  
+def fetch_pdb_lines(pdb_url):
+    """Downloads a PDB file and splits it into lines.
+
+    Args:
+        pdb_url (str): URL of the PDB file.
+
+    Returns:
+        list or None: The lines of the PDB file, or None on error.
+    """
+    if not pdb_url:
+        return None
 
-    output_directory = "data_output"
-    ensure_directory_exists(output_directory)
-    
-    base_filename = os.path.basename(pdb_url)
-    output_filename = f"AM_scores_{base_filename}"
-    output_file = os.path.join(output_directory, output_filename)
-    
     try:
-        logging.info(f"Writing modified PDB data to: {output_file}")
-        with open(output_file, "w", encoding= "utf-8") as out_file:
-            for line in pdb_content:
-                if line.startswith("ATOM") or line.startswith("HETATM"):
-                    residue_number = int(line[22:26].strip())
-                    if residue_number < len(average_scores_file) and not np.isnan(average_scores_file[residue_number]):
-                        value = average_scores_file[residue_number]
-                        value_str = f"{value:.2f}"
-                        while len(value_str) < 6:
-                            value_str = " " + value_str
-                        edit_line = line[:60] + value_str + line[66:]
-                        out_file.write(edit_line + '\n')
-                    else:
-                        out_file.write(line + '\n')
-                else:
-                    out_file.write(line + '\n')
-    except IOError as e:
-        logging.error(f"Error writing to file: {e}")
+        logger.info("Retrieving PDB file")
+        response = SESSION.get(pdb_url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.text.splitlines()
+    except requests.exceptions.RequestException as e:
+        logger.error("Failed to retrieve the PDB file: %s", e)
+        return None
+
 
+def find_atom_lines(pdb_content):
+    """Finds the coordinate records of a PDB file.
 
-def extract_pathogenicity_and_plddt(am_file_path, pdb_file_url):
+    Args:
+        pdb_content (list): Lines of a PDB file.
+
+    Returns:
+        list: Indices of the ATOM and HETATM lines.
     """
-    Extracts pathogenicity scores from an AM file and pLDDT values from a PDB file URL.
+    return [i for i, line in enumerate(pdb_content) if line.startswith(("ATOM", "HETATM"))]
+
+
+def modify_pdb_with_am_data(pdb_content, average_scores_file, output_file):
+    """Writes a copy of a PDB file with B-factors replaced by average AM scores.
 
     Args:
-    am_file_path (str): Path to the AM file containing pathogenicity scores.
-    pdb_file_url (str): URL of the PDB file containing pLDDT values.
+        pdb_content (list): Lines of the original PDB file.
+        average_scores_file (numpy.ndarray): Average pathogenicity score indexed by residue number.
+        output_file (str): Path of the modified PDB file.
 
     Returns:
-    tuple: Two lists:
-    - pathogenicity_scores (list): List of pathogenicity scores.
-    - plddt_scores (list): List of pLDDT scores.
+        list: The B-factor written for each ATOM/HETATM line, as read back from the modified file.
     """
-    pathogenicity_scores = []
-    plddt_scores = []
+    ensure_directory_exists(os.path.dirname(output_file))
+
+    # Format each residue's score once; every atom of that residue reuses the string.
+    # An empty string means the line is kept as is.
+    scored_residues = ~np.isnan(average_scores_file)
+    score_strings = np.full(len(average_scores_file), "", dtype="U6")
+    score_strings[scored_residues] = np.char.mod("%6.2f", average_scores_file[scored_residues])
+
+    atom_lines = find_atom_lines(pdb_content)
+    residue_numbers = np.fromiter((int(pdb_content[i][22:26]) for i in atom_lines),
+                                  dtype=np.intp, count=len(atom_lines))
+    atom_strings = np.full(len(residue_numbers), "", dtype="U6")
+    in_range = residue_numbers < len(score_strings)
+    atom_strings[in_range] = score_strings[residue_numbers[in_range]]
+    line_strings = np.full(len(pdb_content), "", dtype="U6")
+    line_strings[atom_lines] = atom_strings
+
+    edited_lines = [line[:60] + value_str + line[66:] if value_str else line
+                    for line, value_str in zip(pdb_content, line_strings.tolist())]
 
-    # Extract Pathogenicity Scores from AM File
     try:
-        with open(am_file_path, "r") as f:
-            am_pdb = f.read()
+        logger.info("Writing modified PDB data to: %s", output_file)
+        # Build the whole file in memory and write it with a single call
+        with open(output_file, "w", encoding= "utf-8") as out_file:
+            if edited_lines:
+                out_file.write('\n'.join(edited_lines) + '\n')
+    except IOError as e:
+        logger.error("Error writing to file: %s", e)
+
+    # Returned so callers do not have to read the file back in to plot it
+    return [float(edited_lines[i][60:66]) for i in atom_lines]
 
-        for line in am_pdb.splitlines():
-            if line.startswith(("ATOM", "HETATM")):
-                pathogenicity_scores.append(float(line[60:66].strip()))
 
-    except FileNotFoundError:
-        logging.error(f"AM file not found: {am_file_path}")
+def extract_plddt_scores(pdb_content):
+    """
+    Extracts pLDDT values from the original PDB file.
+
+    Args:
+    pdb_content (list): Lines of the original PDB file containing pLDDT values.
+
+    Returns:
+    list: List of pLDDT scores.
+    """
+    try:
+        return [float(pdb_content[i][60:66]) for i in find_atom_lines(pdb_content)]
     except ValueError:
-        logging.error("Error parsing pathogenicity scores in the AM file.")
+        logger.error("Error parsing pLDDT scores in the PDB file.")
+        return []
 
-    # Extract pLDDT Scores from PDB URL
-    if pdb_file_url:
-        logging.info(f"Fetching PDB data from {pdb_file_url}")
 
-        try:
-            response = requests.get(pdb_file_url)
-            response.raise_for_status()
-            pdb_content = response.text.splitlines()
+def process_am_for_uniprot_id(uniprot_id):
+    """
+    Fetches the AFDB entry for a single UniProt ID and writes its AM outputs.
 
-            for line in pdb_content:
-                if line.startswith(("ATOM", "HETATM")):
-                    plddt_scores.append(float(line[60:66].strip()))
-        
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error fetching PDB data: {e}")
-        except ValueError:
-            logging.error("Error parsing pLDDT scores in the PDB file.")
+    Args:
+        uniprot_id (str): The UniProt accession code.
+    """
+    try:
+        data = fetch_AFDB_data(uniprot_id)
+        if data:
+            am_data_url = extract_alpha_missense_url(data)
+            
+            if am_data_url is None:
+                logger.debug("No AlphaMissense data for %s", uniprot_id)
+                return
+
+            am_data = extract_am_data(am_data_url)
+            pdb_data_url = extract_pdb_url(data)
+            # Downloaded once and shared by the B-factor rewrite and the pLDDT extraction
+            pdb_content = fetch_pdb_lines(pdb_data_url)
+            
+            if am_data is not None:
+                average_scores = calculate_average_pathogenicity(am_data)
+                print(uniprot_id)
+                with PLOT_LOCK:
+                    plots.plot_am_heatmap(am_data, uniprot_id)
 
-    return pathogenicity_scores, plddt_scores
+                if pdb_content is not None:
+                    file_path = os.path.join("data_output", f"AM_scores_{os.path.basename(pdb_data_url)}")
+                    # The written AM scores are returned directly rather than re-read from file_path
+                    pathogenicity_scores = modify_pdb_with_am_data(pdb_content, average_scores, file_path)
+                    plddt_scores = extract_plddt_scores(pdb_content)
+                    print(uniprot_id)
+                    with PLOT_LOCK:
+                        plots.plot_scores(pathogenicity_scores, plddt_scores, uniprot_id)
+                        
+    except requests.exceptions.RequestException as e:
+        print(f"Error processing {uniprot_id}: {e}")
 
 
-def process_am_from_file(filename):
+def process_am_from_file(filename, max_workers=8):
     """
     Reads UniProt IDs from a text file, fetches data and extracts URLs.
 
     Args:
         filename (str): The name of the file containing UniProt IDs.
-        extract_am_files (bool): Whether to extract files from amAnnotationsHg19Url and amAnnotationsHg38Url.
+        max_workers (int): Number of UniProt IDs processed concurrently.
     """
-    
-    with open(filename, 'r') as f:
-        uniprot_ids = f.read().replace(' ', '').split(',')  # Remove whitespace and split by comma
-        
+    uniprot_ids = read_uniprot_ids(filename)
+
     output_dir = "downloaded_files"
     os.makedirs(output_dir, exist_ok=True)
 
-    
-    for uniprot_id in uniprot_ids:
-        try:
-            data = fetch_AFDB_data(uniprot_id)
-            if data:
-                am_data_url = extract_alpha_missense_url(data)
-                
-                if not am_data_url or not am_data_url.startswith("http"):  # Check for both None and invalid URLs
-                    continue
-
-                am_data = extract_am_data(am_data_url)
-                pdb_data_url = extract_pdb_url(data)
-                
-                if am_data is not None:
-                    average_scores = calculate_average_pathogenicity(am_data)
-                    modify_pdb_with_am_data(pdb_data_url, average_scores)
-                    print(uniprot_id)
-                    plots.plot_am_heatmap(am_data, uniprot_id)
-                
-
-                file_path= f"data_output/AM_scores_AF-{uniprot_id}-F1-model_v4.pdb"
-                pathogenicity_scores, plddt_scores = extract_pathogenicity_and_plddt(file_path, pdb_data_url)
-
-                print(uniprot_id)
-                plots.plot_scores(pathogenicity_scores, plddt_scores, uniprot_id)
-                            
-        except requests.exceptions.RequestException as e:
-            print(f"Error processing {uniprot_id}: {e}")
+    # Each ID is dominated by network round-trips, so overlap them in threads
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(process_am_for_uniprot_id, uniprot_ids))
 
 
 
@@ -243,10 +286,11 @@ def process_am_from_file(filename):
 def main():
     parser = argparse.ArgumentParser(description='Fetch and extract URLs from the AlphaFold Database API.')
     parser.add_argument('filename', help='Text file containing UniProt IDs, one per line')
+    parser.add_argument('--workers', type=int, default=8, help='Number of UniProt IDs to process in parallel (default: 8)')
     args = parser.parse_args()
 
     # Call the process_uniprot_ids_from_file function with the provided filename and output option
-    process_am_from_file(args.filename)
+    process_am_from_file(args.filename, args.workers)
 
 # Call the main function if this script is run directly
 if __name__ == '__main__':
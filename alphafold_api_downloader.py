@@ -1,39 +1,225 @@
+import asyncio
+import aiohttp
+import aiofiles
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import logging
 import argparse
 import os
+import json
+import sqlite3
+import tempfile
 import time
+import random
+import functools
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+try:
+    import orjson  # Optional, decodes the API responses faster than the json module
+except ImportError:
+    orjson = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def sleep_and_retry(func, timeout=5):
+# Shared session so every request to the AFDB host reuses a pooled keep-alive connection.
+# Transient errors and rate limiting (429) are retried with backoff, honouring Retry-After.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=True)))
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) seconds
+
+AFDB_API_URL = "https://alphafold.ebi.ac.uk/api/prediction/{}"
+AFDB_CACHE_DIR = os.path.join("downloaded_files", ".afdb_cache")  # API responses kept for conditional requests
+MAX_CONCURRENT_IDS = 16  # UniProt IDs processed at the same time by the async downloader
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB reads keep the per-chunk Python overhead low on large PDB/CIF/PAE files
+PROGRESS_DB_NAME = "afdb.sqlite"  # Index of completed UniProt IDs, kept in the output directory
+PROGRESS_MAX_AGE = 24 * 60 * 60  # Seconds before a completed UniProt ID is downloaded again
+PROGRESS_COMMIT_EVERY = 100  # Completed UniProt IDs recorded per SQLite transaction
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (requests.exceptions.RequestException, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def get_retry_delay(error, attempt, base=0.5, cap=60):
+    """Works out how long to wait before retrying a failed request.
+
+    Args:
+        error (Exception): The error raised by the request.
+        attempt (int): Number of attempts already made, starting at 0.
+        base (float): Delay in seconds for the first retry.
+        cap (float): Maximum delay in seconds.
+
+    Returns:
+        float or None: Seconds to wait, or None if the error should not be retried.
+    """
+    status, headers = None, {}
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status, headers = error.response.status_code, error.response.headers
+    elif isinstance(error, aiohttp.ClientResponseError):
+        status, headers = error.status, error.headers or {}
+
+    # Client errors such as 404 (unknown accession) will not succeed on a retry
+    if status is not None and status not in RETRYABLE_STATUS_CODES:
+        return None
+
+    # Honour the server's cool-down when it gives one, either in seconds or as an HTTP date
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(cap, max(0.0, delay))
+
+    # Exponential backoff with full jitter, so concurrent clients do not retry in lockstep
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry(func, tries=8, base=0.5, cap=60):
+    """Wraps a function so failed requests are retried with exponential backoff.
+
+    Works for both regular functions and coroutine functions. The last error is
+    re-raised once all tries are used up or when the error is not retryable.
+
+    Args:
+        func (callable): The function making the request.
+        tries (int): Maximum number of attempts.
+        base (float): Delay in seconds for the first retry.
+        cap (float): Maximum delay in seconds.
+    """
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            for attempt in range(tries):
+                try:
+                    return await func(*args, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    delay = get_retry_delay(e, attempt, base, cap)
+                    if delay is None or attempt == tries - 1:
+                        raise
+                    logging.warning(f"Request failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+        return async_wrapper
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        while True:
+        for attempt in range(tries):
             try:
                 return func(*args, **kwargs)
-            except requests.exceptions.RequestException:
-                time.sleep(timeout)
+            except RETRYABLE_ERRORS as e:
+                delay = get_retry_delay(e, attempt, base, cap)
+                if delay is None or attempt == tries - 1:
+                    raise
+                logging.warning(f"Request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
 
     return wrapper
 
-def fetch_AFDB_data(uniprot_accession):
+def decode_json(content):
+    """Decodes a JSON document, with orjson when it is installed.
+
+    Args:
+        content (bytes or str): The JSON document.
+
+    Returns:
+        The decoded JSON. Raises ValueError if it is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def load_cached_AFDB_data(uniprot_accession):
+    """Loads a previously saved API response for a UniProt accession.
+
+    Args:
+        uniprot_accession (str): The UniProt accession code.
+
+    Returns:
+        dict or None: The cached entry with 'etag', 'last_modified' and 'data' keys, or None if not cached.
+    """
+    cache_file = os.path.join(AFDB_CACHE_DIR, f"{uniprot_accession}.json")
+    try:
+        with open(cache_file, 'rb') as f:
+            return decode_json(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_AFDB_data(uniprot_accession, headers, data):
+    """Saves an API response together with its validators (ETag / Last-Modified).
+
+    Args:
+        uniprot_accession (str): The UniProt accession code.
+        headers (Mapping): The response headers.
+        data (dict): The JSON result.
+    """
+    os.makedirs(AFDB_CACHE_DIR, exist_ok=True)
+    entry = {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'), 'data': data}
+    cache_file = os.path.join(AFDB_CACHE_DIR, f"{uniprot_accession}.json")
+    try:
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        with tempfile.NamedTemporaryFile('w', dir=AFDB_CACHE_DIR, suffix='.part', delete=False) as f:
+            json.dump(entry, f)
+        os.replace(f.name, cache_file)
+    except OSError as e:
+        logging.warning(f"Could not cache data for {uniprot_accession}: {e}")
+
+
+def conditional_headers(cached):
+    """Builds If-None-Match / If-Modified-Since headers from a cached entry.
+
+    Args:
+        cached (dict or None): The cached entry, see load_cached_AFDB_data.
+
+    Returns:
+        dict: The request headers, empty if nothing is cached.
+    """
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    return headers
+
+
+def fetch_AFDB_data(uniprot_accession, session=SESSION):
     """Fetches data from the AlphaFold Database API.
 
     Args:
         uniprot_accession (str): The UniProt accession code.
+        session (requests.Session): Session used for the request. Defaults to the shared SESSION.
 
     Returns:
         dict or None: The JSON result, or None on error.
     """
-    url = f"https://alphafold.ebi.ac.uk/api/prediction/{uniprot_accession}"
+    url = AFDB_API_URL.format(uniprot_accession)
     try:
         logging.info(f"Fetching data for {uniprot_accession}")
-        response = requests.get(url)
+        cached = load_cached_AFDB_data(uniprot_accession)
+        response = session.get(url, headers=conditional_headers(cached), timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and cached:
+            logging.info(f"Data for {uniprot_accession} not modified, using cached copy")
+            return cached['data']
+
         response.raise_for_status()
         logging.info(f"Successfully retrieved data for {uniprot_accession}")
-        return response.json()
+        data = decode_json(response.content)
+        save_cached_AFDB_data(uniprot_accession, response.headers, data)
+        return data
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         logging.error(f"Error retrieving data for {uniprot_accession}, check UniProt accession")
         return None
 
@@ -43,57 +229,272 @@ def extract_urls(data, uniprot_accession, extract_am_files=False):
 
     Args:
         data (dict): The JSON data from the API.
+        uniprot_accession (str): The UniProt accession code.
+        extract_am_files (bool): Whether to extract files from amAnnotationsHg19Url and amAnnotationsHg38Url.
 
     Returns:
-        str: The AlphaMissense URL, or an error message.
+        dict: The file URLs by API field, None for the files missing from the entry.
+        Empty if no data was provided.
     """
-    if data:
-        logging.info(f"Retrieving data for {uniprot_accession}")
-        result = {}
-        result['alphaMissenseUrl'] = data[0].get('amAnnotationsUrl', f"No AlphaMissense data for {uniprot_accession}")
-        result['pdbUrl'] = data[0].get('pdbUrl', f"No PDB URL for {uniprot_accession}")
-        result['cifUrl'] = data[0].get('cifUrl', f"No PDB URL for {uniprot_accession}") 
-        result['paeImageUrl'] = data[0].get('paeImageUrl', f"No PDB URL for {uniprot_accession}") 
-        
-# Extract additional files if extract_am_files is True
-        if extract_am_files:
-            result['amAnnotationsHg19Url'] = data[0].get('amAnnotationsHg19Url', f"No amAnnotationsHg19Url data for {uniprot_accession}")
-            result['amAnnotationsHg38Url'] = data[0].get('amAnnotationsHg38Url', f"No amAnnotationsHg38Url data for {uniprot_accession}")
+    if not data:
+        return {}
+
+    logging.info(f"Retrieving data for {uniprot_accession}")
+    result = {}
+    result['alphaMissenseUrl'] = data[0].get('amAnnotationsUrl')
+    result['pdbUrl'] = data[0].get('pdbUrl')
+    result['cifUrl'] = data[0].get('cifUrl')
+    result['paeImageUrl'] = data[0].get('paeImageUrl')
+
+    # Extract additional files if extract_am_files is True
+    if extract_am_files:
+        result['amAnnotationsHg19Url'] = data[0].get('amAnnotationsHg19Url')
+        result['amAnnotationsHg38Url'] = data[0].get('amAnnotationsHg38Url')
 
-        return result
-    else:
-        return {
-            'alphaMissenseUrl': f"Error: No data provided for {uniprot_accession}",
-            'pdbUrl': f"Error: No data provided for {uniprot_accession}"
-        }
+    return result
 
 
-def download_file(url, output_dir):
+async def get_json_async(session, url, headers=None):
+    """Requests a URL and decodes its JSON body, raising on HTTP errors.
+
+    Returns:
+        tuple: The response headers and the decoded JSON, or None instead of the JSON on 304 Not Modified.
+    """
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304:
+            return response.headers, None
+        response.raise_for_status()
+        return response.headers, decode_json(await response.read())
+
+
+async def save_url_async(session, url, filename):
+    """Streams the body of a URL into a file, raising on HTTP errors.
+
+    Returns:
+        str or None: The ETag of the downloaded file, if the server sent one.
     """
-    Downloads a file from a given URL.
+    async with session.get(url) as response:
+        response.raise_for_status()
+        # Write to a temporary name first so an interrupted download is never taken for a complete file
+        async with aiofiles.open(filename + '.part', 'wb') as f:
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+        os.replace(filename + '.part', filename)
+        return response.headers.get('ETag')
+
+
+async def is_file_current_async(session, url, filename):
+    """Checks with a HEAD request whether a previously downloaded file is still up to date.
+
+    The ETag saved next to the file is compared when both sides have one, otherwise the size.
 
     Args:
+        session (aiohttp.ClientSession): Session used for the request.
+        url (str): The URL of the file.
+        filename (str): The local copy of the file.
+
+    Returns:
+        bool: True if the local copy matches the remote file.
+    """
+    if not os.path.exists(filename):
+        return False
+
+    try:
+        async with session.head(url, allow_redirects=True) as response:
+            response.raise_for_status()
+            etag = response.headers.get('ETag')
+            content_length = response.headers.get('Content-Length')
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.debug(f"Could not check {url}, downloading it again: {e}")
+        return False
+
+    try:
+        with open(filename + '.etag', 'r') as f:
+            saved_etag = f.read().strip()
+    except OSError:
+        saved_etag = None
+
+    if etag and saved_etag:
+        return etag == saved_etag
+    return content_length is not None and int(content_length) == os.path.getsize(filename)
+
+
+async def fetch_AFDB_data_async(session, uniprot_accession):
+    """Fetches data from the AlphaFold Database API without blocking the event loop.
+
+    Args:
+        session (aiohttp.ClientSession): Session used for the request.
+        uniprot_accession (str): The UniProt accession code.
+
+    Returns:
+        dict or None: The JSON result, or None on error.
+    """
+    url = AFDB_API_URL.format(uniprot_accession)
+    try:
+        logging.info(f"Fetching data for {uniprot_accession}")
+        cached = load_cached_AFDB_data(uniprot_accession)
+        headers, data = await retry(get_json_async)(session, url, conditional_headers(cached))
+        if data is None and cached:
+            logging.info(f"Data for {uniprot_accession} not modified, using cached copy")
+            return cached['data']
+
+        logging.info(f"Successfully retrieved data for {uniprot_accession}")
+        save_cached_AFDB_data(uniprot_accession, headers, data)
+        return data
+
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logging.error(f"Error retrieving data for {uniprot_accession}, check UniProt accession")
+        return None
+
+
+async def download_file_async(session, url, output_dir):
+    """
+    Downloads a file from a given URL without blocking the event loop.
+
+    Args:
+        session (aiohttp.ClientSession): Session used for the request.
         url (str): The URL of the file to download.
         output_dir (str): The directory to save the downloaded file.
+
+    Returns:
+        bool: False if the download failed, True otherwise.
     """
     
-    if not url or not url.startswith("http"):  # Check for both None and invalid URLs
-        return
+    if url is None:
+        return True
 
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
         filename = os.path.join(output_dir, url.split('/')[-1])
-        with open(filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        if await is_file_current_async(session, url, filename):
+            logging.info(f"{filename} is up to date, skipping download")
+            return True
 
+        etag = await retry(save_url_async)(session, url, filename)
         logging.info(f"Downloaded {filename}")
+        # Kept next to the file so the next run can tell whether it changed
+        if etag:
+            with open(filename + '.etag', 'w') as f:
+                f.write(etag)
+        return True
 
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logging.error(f"Error downloading {url}: {e}")
+        return False
+
+
+async def process_uniprot_id_async(session, semaphore, uniprot_id, output_dir, extract_am_files=False):
+    """
+    Fetches the AFDB entry for one UniProt ID and downloads its files.
+
+    Args:
+        session (aiohttp.ClientSession): Session used for the requests.
+        semaphore (asyncio.Semaphore): Limits how many IDs are processed at once.
+        uniprot_id (str): The UniProt accession code.
+        output_dir (str): The directory to save the downloaded files.
+        extract_am_files (bool): Whether to extract files from amAnnotationsHg19Url and amAnnotationsHg38Url.
+
+    Returns:
+        bool: True if the entry was retrieved and all of its files were downloaded.
+    """
+    async with semaphore:
+        data = await fetch_AFDB_data_async(session, uniprot_id)
+        if not data:
+            return False
+        urls = extract_urls(data, uniprot_id, extract_am_files)
+        for field, url in urls.items():
+            if url is None:
+                logging.debug(f"{field} missing for {uniprot_id}")
+
+        # The files of one entry are independent, so download them side by side
+        downloaded = await asyncio.gather(*(download_file_async(session, url, output_dir)
+                                            for url in urls.values() if url is not None))
+        return all(downloaded)
+
+
+def open_progress_db(output_dir):
+    """Opens the SQLite index of UniProt IDs whose files were all downloaded.
+
+    Args:
+        output_dir (str): The directory the files are downloaded to, which also holds the index.
+
+    Returns:
+        sqlite3.Connection: The open index.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(output_dir, PROGRESS_DB_NAME))
+    conn.execute("CREATE TABLE IF NOT EXISTS done (id TEXT PRIMARY KEY, fetched_at REAL, am_files INTEGER)")
+    return conn
+
+
+def load_completed_ids(conn, extract_am_files=False, max_age=PROGRESS_MAX_AGE):
+    """Reads the UniProt IDs completed recently enough to be skipped.
+
+    Args:
+        conn (sqlite3.Connection): The index, see open_progress_db.
+        extract_am_files (bool): Whether the hg19/hg38 AM files are also needed.
+        max_age (float): Seconds after which a completed ID is downloaded again.
+
+    Returns:
+        set: The UniProt IDs that can be skipped.
+    """
+    # An ID completed without the hg19/hg38 files does not count when they are requested
+    rows = conn.execute("SELECT id FROM done WHERE fetched_at > ? AND am_files >= ?",
+                        (time.time() - max_age, int(extract_am_files)))
+    return {uniprot_id for uniprot_id, in rows}
+
+
+async def process_uniprot_ids_async(uniprot_ids, output_dir, extract_am_files=False):
+    """
+    Downloads the AFDB files for all UniProt IDs concurrently.
 
+    Args:
+        uniprot_ids (list): The UniProt accession codes.
+        output_dir (str): The directory to save the downloaded files.
+        extract_am_files (bool): Whether to extract files from amAnnotationsHg19Url and amAnnotationsHg38Url.
+    """
+    # One connection pool for the whole run; the semaphore bounds the IDs in flight
+    connector = aiohttp.TCPConnector(limit=32, limit_per_host=16)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1])
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_IDS)
+
+    # Only the event loop thread touches the index, so one connection is shared by all IDs
+    conn = open_progress_db(output_dir)
+    try:
+        completed = load_completed_ids(conn, extract_am_files)
+        pending = [uniprot_id for uniprot_id in uniprot_ids if uniprot_id not in completed]
+        if len(pending) < len(uniprot_ids):
+            logging.info(f"Skipping {len(uniprot_ids) - len(pending)} UniProt IDs already downloaded")
+
+        async def process_and_record(uniprot_id):
+            if await process_uniprot_id_async(session, semaphore, uniprot_id, output_dir, extract_am_files):
+                conn.execute("INSERT OR REPLACE INTO done VALUES (?, ?, ?)",
+                             (uniprot_id, time.time(), int(extract_am_files)))
+                if conn.total_changes % PROGRESS_COMMIT_EVERY == 0:
+                    conn.commit()
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*(process_and_record(uniprot_id) for uniprot_id in pending))
+    finally:
+        # Also keeps the progress of an interrupted run
+        conn.commit()
+        conn.close()
+
+
+def read_uniprot_ids(filename):
+    """
+    Reads comma separated UniProt IDs from a text file.
+
+    Args:
+        filename (str): The name of the file containing UniProt IDs.
+
+    Returns:
+        list: The UniProt IDs in file order, without blanks or duplicates.
+    """
+    with open(filename, 'r') as f:
+        uniprot_ids = f.read().replace(' ', '').split(',')  # Remove whitespace and split by comma
+
+    # The API has no batch endpoint, so every repeated or empty entry would cost a round-trip
+    return list(dict.fromkeys(uniprot_id.strip() for uniprot_id in uniprot_ids if uniprot_id.strip()))
 
 
 def process_uniprot_ids_from_file(filename, extract_am_files=False):
@@ -104,23 +505,12 @@ def process_uniprot_ids_from_file(filename, extract_am_files=False):
         filename (str): The name of the file containing UniProt IDs.
         extract_am_files (bool): Whether to extract files from amAnnotationsHg19Url and amAnnotationsHg38Url.
     """
-    
-    with open(filename, 'r') as f:
-        uniprot_ids = f.read().replace(' ', '').split(',')  # Remove whitespace and split by comma
-        
+    uniprot_ids = read_uniprot_ids(filename)
+
     output_dir = "downloaded_files"
     os.makedirs(output_dir, exist_ok=True)
 
-    for uniprot_id in uniprot_ids:
-        try:
-            data = sleep_and_retry(fetch_AFDB_data, timeout=5)(uniprot_id)
-            urls = extract_urls(data, uniprot_id, extract_am_files)
-            
-            for url in urls.values():
-                download_file(url, output_dir)
-        
-        except requests.exceptions.RequestException as e:
-            print(f"Error processing {uniprot_id}: {e}")
+    asyncio.run(process_uniprot_ids_async(uniprot_ids, output_dir, extract_am_files))
 
 
 
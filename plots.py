@@ -1,20 +1,85 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
+import numpy as np
 import os
-from matplotlib.colors import LinearSegmentedColormap
+import functools
 import logging
+# Matplotlib is imported inside the plotting functions, so importing this module stays cheap
+
+logger = logging.getLogger(__name__)
+
 
 def ensure_directory_exists(directory):
     if not os.path.exists(directory):
-        os.makedirs(directory)
-        logging.info(f"Created directory: {directory}")
+        os.makedirs(directory, exist_ok=True)
+        logger.info("Created directory: %s", directory)
+
+
+@functools.lru_cache(maxsize=1)
+def create_custom_colormap():
+    """
+    Creates the AlphaMissense colormap, following the original colours from the AlphaFold Database.
+    Built on first use and shared by every heatmap.
+    """
+    from matplotlib.colors import LinearSegmentedColormap, ListedColormap
+
+    cdict = {
+        'red': [
+            (0.0, 56/255, 56/255),
+            (0.34, 204/255, 204/255),
+            (0.464, 204/255, 204/255),
+            (1.0, 165/255, 165/255)
+        ],
+        'green': [
+            (0.0, 83/255, 83/255),
+            (0.34, 204/255, 204/255),
+            (0.464, 204/255, 204/255),
+            (1.0, 13/255, 13/255)
+        ],
+        'blue': [
+            (0.0, 163/255, 163/255),
+            (0.34, 204/255, 204/255),
+            (0.464, 204/255, 204/255),
+            (1.0, 18/255, 18/255)
+        ]
+    }
+    segmented = LinearSegmentedColormap('CustomMap', segmentdata=cdict, N=256)
+    # Sampled once into a plain 256-colour lookup table
+    return ListedColormap(segmented(np.linspace(0, 1, 256)), name='CustomMap')
+
+
+@functools.lru_cache(maxsize=None)
+def get_reusable_figure(name):
+    """
+    Returns the Figure kept for one kind of plot, creating it on first use.
+
+    The figure is not registered with pyplot, so it is cleared and redrawn for every protein
+    instead of being created and closed each time.
+
+    Args:
+        name (str): The kind of plot, e.g. "scores" or "heatmap".
+
+    Returns:
+        matplotlib.figure.Figure: The figure for that kind of plot.
+    """
+    from matplotlib.figure import Figure
+
+    return Figure()
+
+
+# Fast zlib level for the PNGs: encoding dominates the save time of wide heatmaps, for slightly larger files
+PNG_SAVE_OPTIONS = {'compress_level': 1}
+
+# Heatmap rows follow the AlphaFold Database, which groups the amino acids by physicochemical property
+HEATMAP_AA_ORDER = list("RHKDESTNQCPAVILMGFYW")
 
 
+@functools.lru_cache(maxsize=4)
 def plot_plddt_legend(dpi=200):
     """
     Creates and returns a Matplotlib figure containing a legend for pLDDT (predicted Local Distance Difference Test) scores.
 
+    The legend never changes, so the figure is built once per dpi and the same object is returned
+    on later calls; do not close or modify it.
+
     Args:
         dpi (int, optional): The resolution of the figure in dots per inch. Defaults to 100.
 
@@ -24,6 +89,10 @@ def plot_plddt_legend(dpi=200):
     plddt_labels = ["plDDT:", "Very low (<50)", "Low (60)", "Confident (80)", "Very high (>90)"]
     plddt_colors = ["#FFFFFF", "#FF7D45", "#FFFF00", "#65CBF3", "#0000FF"]
 
+    import matplotlib
+    matplotlib.use('Agg')  # Plots are only saved to file, never shown
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(figsize=(1, 0.1), dpi=dpi)  # Create figure and axis objects
 
     # Create legend handles (dummy bars)
@@ -47,7 +116,7 @@ def plot_plddt_legend(dpi=200):
 
 def plot_scores(pathogenicity_scores, plddt_scores, uniprot_id):
     """
-    Plots pathogenicity and rescaled pLDDT scores against residue number using Seaborn.
+    Plots pathogenicity and rescaled pLDDT scores against residue number.
 
     Args:
         pathogenicity_scores (list): List of pathogenicity scores.
@@ -55,43 +124,34 @@ def plot_scores(pathogenicity_scores, plddt_scores, uniprot_id):
     """
 
     # Rescale pLDDT scores from 0-100 to 0-1
-    plddt_rescaled = [score / 100 for score in plddt_scores]
-
-    # Create a DataFrame for easy plotting with Seaborn
-    data = {
-        'Residue number': range(1, len(pathogenicity_scores) + 1),
-        'Average pathogenicity': pathogenicity_scores,
-        'pLDDT (rescaled)': plddt_rescaled
-    }
-    df = pd.DataFrame(data)
+    plddt_rescaled = np.asarray(plddt_scores, dtype=np.float64) / 100
+    residue_numbers = np.arange(1, len(pathogenicity_scores) + 1)
 
-    # Create line plots with Seaborn
-    plt.figure(figsize=(12, 6))
-    ax = plt.subplot(111)
-    sns.lineplot(x='Residue number', y='Average pathogenicity', data=df, label='Average AM score')
-    sns.lineplot(x='Residue number', y='pLDDT (rescaled)', data=df, label='pLDDT (rescaled)')
+    # Plain line plots; there is nothing for Seaborn to aggregate here
+    fig = get_reusable_figure("scores")
+    fig.clear()
+    fig.set_size_inches(12, 6)
+    ax = fig.add_subplot(111)
+    ax.plot(residue_numbers, pathogenicity_scores, label='Average AM score')
+    ax.plot(residue_numbers, plddt_rescaled, label='pLDDT (rescaled)')
 
     # Add labels, title, and legend
-    plt.xlabel('Residue number')
-    plt.ylabel('Score')
-    plt.ylim(0, 1)
-    plt.title(f'Average AM and pLDDT scores per position ({uniprot_id})')
+    ax.set_xlabel('Residue number')
+    ax.set_ylabel('Score')
+    ax.set_ylim(0, 1)
+    ax.set_title(f'Average AM and pLDDT scores per position ({uniprot_id})')
     
     # Place the legend outside the chart
     ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.1),
               fancybox=True, shadow=True, ncol=5)
 
-    plt.grid(axis='y', linestyle='--')  # Optional grid
+    ax.grid(axis='y', linestyle='--')  # Optional grid
 
         # Save the plot to a file
-    plt.tight_layout(rect=[0, 0.1, 1, 1])  # Leaves space below for the legend
+    fig.tight_layout(rect=[0, 0.1, 1, 1])  # Leaves space below for the legend
     output_directory = "data_output"
     output_file = os.path.join(output_directory, f"graph_plDDT-AM-score_{uniprot_id}.png")
-    plt.savefig(output_file) #save file 
-    
-    # Show the plot
-    #plt.show()
-    plt.close()
+    fig.savefig(output_file, pil_kwargs=PNG_SAVE_OPTIONS) #save file 
 
 
 
@@ -102,75 +162,64 @@ def plot_am_heatmap(am_data, uniprot_id):
     Colour coded following the original colours from the AlphaFold Database, see: https://alphafold.ebi.ac.uk/entry/Q5VSL9
     """
 
-    # custom palette
-    def create_custom_colormap():
-        cdict = {
-            'red': [
-                (0.0, 56/255, 56/255),
-                (0.34, 204/255, 204/255),
-                (0.464, 204/255, 204/255),
-                (1.0, 165/255, 165/255)
-            ],
-            'green': [
-                (0.0, 83/255, 83/255),
-                (0.34, 204/255, 204/255),
-                (0.464, 204/255, 204/255),
-                (1.0, 13/255, 13/255)
-            ],
-            'blue': [
-                (0.0, 163/255, 163/255),
-                (0.34, 204/255, 204/255),
-                (0.464, 204/255, 204/255),
-                (1.0, 18/255, 18/255)
-            ]
-        }
-        return LinearSegmentedColormap('CustomMap', segmentdata=cdict)
-
-    # custom colormap
-    custom_cmap = create_custom_colormap()
-
-    # pivot table
-    pivot_table = pd.pivot_table(am_data, values='pathogenicity_score',
-                                 index='alternative_aa', columns='residue_number')
+    # Each (alternative AA, residue number) pair occurs once in AM data, so the scores are
+    # scattered straight into the matrix rather than aggregated
+    alternative_aa = am_data['alternative_aa'].astype('category').cat.set_categories(HEATMAP_AA_ORDER)
+    aa_codes = alternative_aa.cat.codes.to_numpy(dtype=np.intp)
+    known_aa = aa_codes >= 0
+    aa_codes = aa_codes[known_aa]
+    residue_numbers = am_data['residue_number'].to_numpy(dtype=np.intp)[known_aa]
+    scores = am_data['pathogenicity_score'].to_numpy(dtype=np.float64)[known_aa]
+    n_rows = len(HEATMAP_AA_ORDER)
+
+    # Only keep the residue numbers present in the data
+    residue_columns, column_index = np.unique(residue_numbers, return_inverse=True)
+    heatmap = np.full((n_rows, len(residue_columns)), np.nan)
+    heatmap[aa_codes, column_index] = scores
 
     #if the sequence is too long, then the axis looks all cluttered
-    sequence_length = pivot_table.shape[1] # Determine the length of the protein sequence
+    sequence_length = heatmap.shape[1] # Determine the length of the protein sequence
 
     # Dynamically adjust the figure size.  You can adjust the scaling factors as needed.
     fig_width = max(10, sequence_length * 0.15)  # Minimum width of 10 inches
     fig_height = 6  # Keep height constant, or adjust as needed
-    plt.figure(figsize=(fig_width, fig_height))
-    ax = sns.heatmap(pivot_table, cmap=custom_cmap, vmin=0, vmax=1,
-                     cbar_kws={'label': 'AlphaMissense score'})  # Limits for the color scale
+    fig = get_reusable_figure("heatmap")
+    fig.clear()
+    fig.set_size_inches(fig_width, fig_height)
+    ax = fig.add_subplot(111)
+    # imshow draws the matrix as a single image instead of one patch per cell
+    image = ax.imshow(heatmap, aspect='auto', interpolation='nearest',
+                      cmap=create_custom_colormap(), vmin=0, vmax=1)  # Limits for the color scale
 
     ax.set_xlabel('Residue Number')
     ax.set_ylabel('Alternative Amino Acid')
-    plt.title(f'AlphaMissense Pathogenicity Heatmap ({uniprot_id})')
+    ax.set_title(f'AlphaMissense Pathogenicity Heatmap ({uniprot_id})')
 
-    primary_xticks = range(0, pivot_table.shape[1], 20)  # Ticks for the primary x-axis
+    primary_xticks = range(0, heatmap.shape[1], 20)  # Ticks for the primary x-axis
     ax.set_xticks(primary_xticks)
-    ax.set_xticklabels(pivot_table.columns[primary_xticks])
+    ax.set_xticklabels(residue_columns[primary_xticks])
+    ax.set_yticks(range(n_rows))
+    ax.set_yticklabels(HEATMAP_AA_ORDER)
     ax.set_facecolor('black')  # Set background black for matching AA
-    plt.yticks(rotation=0)
 
-    cbar = ax.collections[0].colorbar
+    cbar = fig.colorbar(image, ax=ax, label='AlphaMissense score')
     cbar.set_ticks([i / 10.0 for i in range(11)])
     cbar.set_ticklabels([f'{i / 10.0:.1f}' for i in range(11)])
 
     # Create the second x-axis
     ax2 = ax.twiny()  # Create a twin Axes sharing the y-axis
 
-    # Get unique residue numbers and corresponding reference amino acids, preserving order
+    # Map each residue number to its reference amino acid once, instead of scanning the data per tick
     unique_residues = am_data[['residue_number', 'reference_aa']].drop_duplicates(subset=['residue_number'])
-    unique_residues = unique_residues.sort_values('residue_number')
+    reference_aa = dict(zip(unique_residues['residue_number'], unique_residues['reference_aa']))
 
     # Set the tick locations and labels for the top x-axis
-    secondary_xticks = range(0, pivot_table.shape[1], 1)  # Show all ticks
+    secondary_xticks = range(0, heatmap.shape[1], 1)  # Show all ticks
+    ax2.set_xlim(ax.get_xlim())  # Keep the reference residues aligned with the heatmap columns
     ax2.set_xticks(secondary_xticks)
 
-    ref_aa_labels = [unique_residues[unique_residues['residue_number'] == i]['reference_aa'].values[0]
-                       if i in unique_residues['residue_number'].values else ''
-                       for i in secondary_xticks]
+    # Tick i sits on heatmap column i, which holds residue residue_columns[i]
+    ref_aa_labels = [reference_aa.get(residue, '') for residue in residue_columns[secondary_xticks]]
 
     ax2.set_xticklabels(ref_aa_labels)
     ax2.set_xlabel(' ')  # Label the top x-axis
@@ -178,14 +227,11 @@ def plot_am_heatmap(am_data, uniprot_id):
     ax2.tick_params(axis='x', labelsize='small')
 
     # Adjust layout to prevent labels from overlapping
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Save the plot to a file
     output_directory = "data_output"
     ensure_directory_exists(output_directory)
     
     output_file = os.path.join(output_directory, f"AM_heatmap_{uniprot_id}.png")
-    plt.savefig(output_file) #save file 
-    #plt.show() # Show plot
-
-    plt.close() # Close the figure after saving to free up resources
+    fig.savefig(output_file, pil_kwargs=PNG_SAVE_OPTIONS) #save file 